@@ -1,104 +1,255 @@
+import os
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import yfinance as yf
+from curl_cffi import requests as curl_requests
+from numba import njit, prange
 
-# Load stock list
-@st.cache_data
-def load_stocklist():
-    file_path = "stocklist.xlsx"
-    xls = pd.ExcelFile(file_path)
-    sheets = xls.sheet_names  # Get sheet names
-    return {sheet: pd.read_excel(xls, sheet_name=sheet)['Symbol'].dropna().tolist() for sheet in sheets}
+# Yahoo requests are network-bound, so fetch symbols concurrently
+MAX_WORKERS = 32
+# Yahoo responses are cached in memory for an hour and keyed on the current date
+CACHE_TTL = 3600
 
-# Fetch stock data from yfinance and calculate technical indicators
-def get_stock_data(symbol):
-    try:
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        earnings = stock.calendar
-        
-        # Fundamental Factors
-        earnings_surprise = info.get('earningsSurprise', np.nan)  # % Earnings Beat
-        revenue_growth = info.get('revenueGrowth', np.nan)
-        
-        # Fetch historical price data (6 months)
-        hist = stock.history(period="6mo")
-        
-        if not hist.empty:
-            # Calculate technical indicators manually
-            
-            # EMA50 (Exponential Moving Average)
-            hist['EMA50'] = hist['Close'].ewm(span=50, adjust=False).mean()
-            
-            # RSI (Relative Strength Index)
-            delta = hist['Close'].diff()
-            gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-            loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-            rs = gain / loss
-            hist['RSI'] = 100 - (100 / (1 + rs))
-            
-            # MACD (Moving Average Convergence Divergence)
-            fast_ema = hist['Close'].ewm(span=12, adjust=False).mean()
-            slow_ema = hist['Close'].ewm(span=26, adjust=False).mean()
-            hist['MACD'] = fast_ema - slow_ema
-            hist['MACD_Signal'] = hist['MACD'].ewm(span=9, adjust=False).mean()
-            
-            # Volume Surge (compared to the 20-day moving average volume)
-            hist['Volume Surge'] = hist['Volume'] / hist['Volume'].rolling(20).mean()
-            
-            # Calculate technical conditions
-            price_above_ema = 1 if hist['Close'].iloc[-1] > hist['EMA50'].iloc[-1] else 0
-            rsi_positive = 1 if hist['RSI'].iloc[-1] > 50 else 0
-            macd_crossover = 1 if hist['MACD'].iloc[-1] > hist['MACD_Signal'].iloc[-1] else 0
-            volume_surge = 1 if hist['Volume Surge'].iloc[-1] > 1.5 else 0
+STOCKLIST_PATH = "stocklist.xlsx"
+
+# Bars needed before EMA50 is meaningful; with fewer, "Price > EMA50" is scored 0
+MIN_HISTORY = 50
+
+# Load stock list; keyed on the file's mtime so edits to the workbook invalidate the disk cache
+@st.cache_data(persist="disk")
+def load_stocklist(mtime):
+    sheets = pd.read_excel(STOCKLIST_PATH, sheet_name=None, usecols=["Symbol"], engine="calamine")
+    return {sheet: df['Symbol'].dropna().tolist() for sheet, df in sheets.items()}
+
+# Last value of Series.ewm(span=span, adjust=False).mean()
+@njit(cache=True)
+def ema_last(x, span):
+    alpha = 2.0 / (span + 1)
+    ema = x[0]
+    for i in range(1, len(x)):
+        ema = alpha * x[i] + (1 - alpha) * ema
+    return ema
+
+# Last MACD line and signal line values, with every EMA updated in the same sweep
+@njit(cache=True)
+def macd_last(close, fast=12, slow=26, signal=9):
+    alpha_fast = 2.0 / (fast + 1)
+    alpha_slow = 2.0 / (slow + 1)
+    alpha_signal = 2.0 / (signal + 1)
+    fast_ema = slow_ema = close[0]
+    macd = macd_signal = 0.0
+    for i in range(1, len(close)):
+        fast_ema = alpha_fast * close[i] + (1 - alpha_fast) * fast_ema
+        slow_ema = alpha_slow * close[i] + (1 - alpha_slow) * slow_ema
+        macd = fast_ema - slow_ema
+        macd_signal = alpha_signal * macd + (1 - alpha_signal) * macd_signal
+    return macd, macd_signal
+
+# Last value of Wilder's RSI: seeded with the mean of the first n moves, then smoothed
+@njit(cache=True)
+def rsi_last(close, n=14):
+    if len(close) <= n:
+        return np.nan
+    avg_gain = avg_loss = 0.0
+    for i in range(1, len(close)):
+        change = close[i] - close[i - 1]
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        if i <= n:
+            avg_gain += gain / n
+            avg_loss += loss / n
         else:
-            price_above_ema = rsi_positive = macd_crossover = volume_surge = np.nan
-
-        # Next Earnings Date
-        next_earnings_date = earnings.get('Earnings Date', [np.nan])[0]
-
-        return {
-            "Symbol": symbol,
-            "Earnings Surprise %": earnings_surprise if pd.notna(earnings_surprise) else 0,
-            "Revenue Growth": revenue_growth if pd.notna(revenue_growth) else 0,
-            "Price > EMA50": price_above_ema,
-            "RSI > 50": rsi_positive,
-            "MACD Bullish": macd_crossover,
-            "Volume Surge": volume_surge,
-            "Next Earnings Date": next_earnings_date
-        }
+            avg_gain = (avg_gain * (n - 1) + gain) / n
+            avg_loss = (avg_loss * (n - 1) + loss) / n
+    return 100.0 if avg_loss == 0 else 100 - 100 / (1 + avg_gain / avg_loss)
+
+# Last close, EMA50, RSI, MACD, MACD signal and volume ratio for one symbol
+@njit(cache=True)
+def symbol_indicators(close, volume):
+    tails = np.full(6, np.nan)
+    traded = ~np.isnan(close)
+    close = close[traded]
+    volume = volume[traded]
+    if len(close) == 0:
+        return tails
+    
+    tails[0] = close[-1]
+    if len(close) >= MIN_HISTORY:
+        tails[1] = ema_last(close, 50)
+    tails[2] = rsi_last(close, 14)
+    tails[3], tails[4] = macd_last(close)
+    
+    # Volume Surge (compared to the 20-day moving average volume), missing volume counts as 0
+    if len(volume) >= 20:
+        total = 0.0
+        for v in volume[-20:]:
+            total += 0.0 if np.isnan(v) else v
+        last = 0.0 if np.isnan(volume[-1]) else volume[-1]
+        if total > 0:
+            tails[5] = last / (total / 20)
+    return tails
+
+# Indicator tails for every symbol of a (symbols x bars) price panel, one symbol per thread
+@njit(parallel=True, cache=True)
+def compute_indicators(close, volume):
+    tails = np.empty((close.shape[0], 6))
+    for i in prange(close.shape[0]):
+        tails[i] = symbol_indicators(close[i], volume[i])
+    return tails
+
+# Compile the kernels at startup
+compute_indicators(np.zeros((1, 2), dtype=np.float32), np.zeros((1, 2), dtype=np.float32))
+
+# Technical flags in TECHNICAL_COLUMNS order, compared across all symbols at once
+def technical_flags(tails):
+    close, ema50, rsi, macd, macd_signal, volume_ratio = tails.T
+    return np.stack([close > ema50, rsi > 50, macd > macd_signal, volume_ratio > 1.5], axis=1).astype(np.int8)
+
+# One HTTP/2 session per process, also registered as yfinance's shared session
+@st.cache_resource
+def get_session():
+    session = curl_requests.Session(impersonate="chrome")
+    yf.data.YfData(session=session)
+    return session
+
+# Fetch 6 months of daily prices for every symbol in one batched request
+@st.cache_data(ttl=CACHE_TTL, max_entries=16, show_spinner=False)
+def get_price_history(symbols, day):
+    panel = yf.download(symbols, period="6mo", interval="1d", group_by="ticker",
+                        threads=True, progress=False, session=get_session())
+    # yfinance reports failed downloads as NaN columns; raise so the failure isn't cached
+    if panel is None or panel.empty or panel.xs("Close", axis=1, level=1).isna().all().all():
+        raise ValueError("No price history returned from Yahoo Finance")
+    return panel
+
+# One field of the batched download as a float32 (symbols x bars) matrix, NaN where a symbol has no data
+def get_price_matrix(panel, symbols, field):
+    if panel is None or panel.empty:
+        return np.full((len(symbols), 0), np.nan, dtype=np.float32)
+    matrix = panel.xs(field, axis=1, level=1).reindex(columns=symbols).to_numpy(dtype=np.float32).T
+    # Keep each symbol's bars contiguous for the kernel; a no-op for pandas' usual block layout
+    return np.ascontiguousarray(matrix)
+
+# quoteSummary modules read by the strategy
+QUOTE_SUMMARY_URL = "https://query2.finance.yahoo.com/v10/finance/quoteSummary/"
+FUNDAMENTAL_MODULES = "financialData,calendarEvents,earningsHistory"
+
+# Plain value of a quoteSummary field, which may arrive as {"raw": ..., "fmt": ...}; NaN if missing
+def raw_value(value):
+    if isinstance(value, dict):
+        value = value.get("raw")
+    return np.nan if value is None else value
+
+# Fetch fundamentals and the next earnings date from yfinance
+@st.cache_data(ttl=CACHE_TTL, max_entries=2000, show_spinner=False)
+def get_fundamentals(symbol, day):
+    params = {"modules": FUNDAMENTAL_MODULES, "formatted": "false",
+              "corsDomain": "finance.yahoo.com", "symbol": symbol}
+    summary = yf.data.YfData().get_raw_json(QUOTE_SUMMARY_URL + symbol, params=params)
+    summary = summary["quoteSummary"]["result"][0]
+    
+    earnings_history = summary.get("earningsHistory", {}).get("history") or [{}]
+    earnings_dates = summary.get("calendarEvents", {}).get("earnings", {}).get("earningsDate") or [np.nan]
+    return {
+        "earnings_surprise": raw_value(earnings_history[-1].get("surprisePercent")),  # % Earnings Beat
+        "revenue_growth": raw_value(summary.get("financialData", {}).get("revenueGrowth")),
+        "next_earnings_date": pd.to_datetime(raw_value(earnings_dates[0]), unit="s").date(),
+    }
+
+FUNDAMENTAL_COLUMNS = ["Symbol", "Earnings Surprise %", "Revenue Growth", "Next Earnings Date"]
+TECHNICAL_COLUMNS = ["Price > EMA50", "RSI > 50", "MACD Bullish", "Volume Surge"]
+NUMERIC_COLUMNS = ["Earnings Surprise %", "Revenue Growth"] + TECHNICAL_COLUMNS
+
+# Fetch fundamental factors for a symbol from yfinance
+def get_stock_data(symbol, day):
+    try:
+        fundamentals = get_fundamentals(symbol, day)
+        earnings_surprise = fundamentals["earnings_surprise"]
+        revenue_growth = fundamentals["revenue_growth"]
+
+        # One row, in FUNDAMENTAL_COLUMNS order
+        return (
+            symbol,
+            earnings_surprise if pd.notna(earnings_surprise) else 0,
+            revenue_growth if pd.notna(revenue_growth) else 0,
+            fundamentals["next_earnings_date"],
+        )
     except Exception as e:
         return None
 
+# Fundamental and technical features for a stock list; the Yahoo fetches underneath are cached,
+# so widget toggles only recompute indicators and scores and failed fetches are retried
+def get_stock_features(symbols, day):
+    # Indicators for all symbols in one compiled pass over the batched price panel
+    price_panel = get_price_history(symbols, day)
+    tails = compute_indicators(get_price_matrix(price_panel, symbols, "Close"),
+                               get_price_matrix(price_panel, symbols, "Volume"))
+    signals = technical_flags(tails)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        stock_data = list(executor.map(get_stock_data, symbols, [day] * len(symbols)))
+
+    # Build the frame column-wise from the transposed rows, keeping symbols with both fundamentals and prices
+    keep = ~np.isnan(tails[:, 0]) & np.array([row is not None for row in stock_data], dtype=bool)
+    rows = [row for row, kept in zip(stock_data, keep) if kept]
+    columns = {column: np.asarray(values) for column, values in zip(FUNDAMENTAL_COLUMNS, zip(*rows))}
+    columns.update(zip(TECHNICAL_COLUMNS, signals[keep].T))
+    return pd.DataFrame(columns, columns=FUNDAMENTAL_COLUMNS + TECHNICAL_COLUMNS)
+
+# (fundamental, technical) position-size weights per risk tolerance; anything else is Balanced
+RISK_WEIGHTS = {
+    "Aggressive": (1.2, 0.8),
+    "Conservative": (0.8, 1.2),
+}
+
+# Descending rank with ties averaged, like Series.rank(ascending=False); x must not contain NaN
+def fast_rank_desc(x):
+    _, inverse, counts = np.unique(-x, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    return (ends - (counts - 1) / 2)[inverse]
+
 # Rank stocks based on Earnings Momentum & Breakout Strategy
-def calculate_stock_scores(df, risk_tolerance):
-    df = df.dropna().reset_index(drop=True)
+def calculate_stock_scores(df, risk_tolerance, top_n=10):
+    # Rows with no missing values
+    complete = (df["Next Earnings Date"].notna().to_numpy()
+                & ~np.isnan(df[NUMERIC_COLUMNS].to_numpy(dtype=np.float64)).any(axis=1))
+    rows = np.flatnonzero(complete)
     
     # Assigning Scores
-    df["Fundamental Score"] = df["Earnings Surprise %"].rank(ascending=False) + df["Revenue Growth"].rank(ascending=False)
-    df["Technical Score"] = df["Price > EMA50"] + df["RSI > 50"] + df["MACD Bullish"] + df["Volume Surge"]
+    fundamental = (fast_rank_desc(df["Earnings Surprise %"].to_numpy(dtype=np.float64)[rows])
+                   + fast_rank_desc(df["Revenue Growth"].to_numpy(dtype=np.float64)[rows]))
+    technical = df[TECHNICAL_COLUMNS].to_numpy(dtype=np.float64)[rows].sum(axis=1)
 
     # Calculate Breakout Probability %
-    df["Breakout Probability %"] = ((df["Fundamental Score"] * 0.5) + (df["Technical Score"] * 0.5)) * 10
+    probability = (fundamental * 0.5 + technical * 0.5) * 10
     
     # Adjusting allocation based on risk tolerance
-    if risk_tolerance == "Aggressive":
-        df["Position Size"] = df["Fundamental Score"] * 1.2 + df["Technical Score"] * 0.8
-    elif risk_tolerance == "Conservative":
-        df["Position Size"] = df["Fundamental Score"] * 0.8 + df["Technical Score"] * 1.2
-    else:
-        df["Position Size"] = df["Fundamental Score"] + df["Technical Score"]
-
-    df = df.sort_values(by="Breakout Probability %", ascending=False)
+    fundamental_weight, technical_weight = RISK_WEIGHTS.get(risk_tolerance, (1.0, 1.0))
+    position_size = fundamental * fundamental_weight + technical * technical_weight
+
+    # Select the top_n picks in O(N), then sort only those
+    top = np.arange(len(probability))
+    if len(probability) > top_n:
+        top = np.argpartition(-probability, top_n - 1)[:top_n]
+    top = top[np.argsort(-probability[top], kind="stable")]
     
-    return df
+    # Only the selected rows are materialized, with their scores attached
+    return df.iloc[rows[top]].assign(**{
+        "Fundamental Score": fundamental[top],
+        "Technical Score": technical[top],
+        "Breakout Probability %": probability[top],
+        "Position Size": position_size[top],
+    })
 
 # Streamlit UI
 st.title("📊 Earnings Momentum + Breakout Strategyo")
 
 # Load stocklist
-stocklist = load_stocklist()
+stocklist = load_stocklist(os.path.getmtime(STOCKLIST_PATH))
 sheet_selection = st.selectbox("Select Stock List", options=list(stocklist.keys()))
 
 # User Inputs
@@ -109,8 +260,12 @@ time_horizon = st.radio("Select Time Horizon", ["Hold until Earnings", "Hold 3M
 symbols = stocklist[sheet_selection]
 st.write(f"Fetching data for {len(symbols)} stocks...")
 
-stock_data = [get_stock_data(symbol) for symbol in symbols]
-stock_df = pd.DataFrame([s for s in stock_data if s])
+# Register the shared session before any worker thread talks to Yahoo
+get_session()
+try:
+    stock_df = get_stock_features(symbols, date.today())
+except ValueError:
+    stock_df = pd.DataFrame()
 
 # Check if data exists
 if not stock_df.empty:
@@ -118,13 +273,15 @@ if not stock_df.empty:
     
     # Display top stock picks with Breakout Probability %
     st.subheader("🏆 Pre-Earnings Stock Picks")
-    st.dataframe(filtered_df[["Symbol", "Next Earnings Date", "Breakout Probability %", "Position Size"]].head(10))
+    st.dataframe(filtered_df[["Symbol", "Next Earnings Date", "Breakout Probability %", "Position Size"]])
     
     # Entry & Exit Strategy
     st.subheader("📈 Entry/Exit Points")
-    filtered_df["Entry Point"] = "Buy now (pre-earnings)"
-    filtered_df["Exit Point"] = "Sell after earnings" if time_horizon == "Hold until Earnings" else "Hold 3 months"
-    st.dataframe(filtered_df[["Symbol", "Breakout Probability %", "Entry Point", "Exit Point"]].head(10))
+    exit_point = "Sell after earnings" if time_horizon == "Hold until Earnings" else "Hold 3 months"
+    st.dataframe(filtered_df[["Symbol", "Breakout Probability %"]].assign(**{
+        "Entry Point": "Buy now (pre-earnings)",
+        "Exit Point": exit_point,
+    }))
 
 else:
     st.warning("No stock data found. Try selecting another sheet or check stock symbols.")